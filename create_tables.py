@@ -1,4 +1,28 @@
+from sqlalchemy import text
 from database import Base, engine
 from database import PDFHistory  # Or your other models
+import models  # noqa: F401 - registers PYQ on Base.metadata
+
+if engine.dialect.name == "postgresql":
+    # PYQ.embedding is a pgvector column
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
 
 Base.metadata.create_all(bind=engine)
+
+if engine.dialect.name == "postgresql":
+    # create_all() skips tables that already exist, so add columns introduced later
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE pyqs ADD COLUMN IF NOT EXISTS embedding vector({models.EMBEDDING_DIM})"
+        ))
+
+# create_all() skips tables that already exist, so backfill indexes added later
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+# Indexes superseded by the composite indexes above
+for index_name in ("idx_pyq_subject", "idx_pdf_history_subject", "idx_pdf_history_ts_covering"):
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
@@ -1,7 +1,23 @@
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Tuple
+from itertools import islice
+import csv
+import io
 import models
 
+# PostgreSQL COPY batch size; larger inputs are streamed in chunks of this many rows
+COPY_BATCH_SIZE = 1000
+
+PYQ_COLUMNS = ("subject", "sub_topic", "question", "marks", "year")
+# csv.writer emits "" unquoted, which COPY reads as NULL; FORCE_NOT_NULL keeps the
+# optional text columns as "" like the INSERT path does
+PYQ_COPY_SQL = (
+    f"COPY pyqs ({', '.join(PYQ_COLUMNS)}) FROM STDIN "
+    f"WITH (FORMAT csv, FORCE_NOT_NULL (sub_topic, year))"
+)
+
+
 def get_pyqs_by_subject(db: Session, subject: str) -> List[models.PYQ]:
     """
     Retrieve all PYQ entries for the given subject.
@@ -9,33 +25,66 @@ def get_pyqs_by_subject(db: Session, subject: str) -> List[models.PYQ]:
     return db.query(models.PYQ).filter(models.PYQ.subject == subject).all()
 
 
-def store_pyqs(db: Session, pyqs: List[Dict], subject: str) -> int:
+def _iter_pyq_rows(pyqs: Iterable[Dict], subject: str) -> Iterator[Tuple]:
     """
-    Store a list of PYQs in the database under the given subject.
-    Returns the number of successfully inserted records.
+    Yield (subject, sub_topic, question, marks, year) tuples for valid PYQ entries.
     """
-    pyq_objects = []
     for entry in pyqs:
         # Basic validation
         question = entry.get("question")
         if not question:
             continue  # skip invalid entries or raise error as needed
 
-        pyq_obj = models.PYQ(
-            subject=subject,
-            sub_topic=entry.get("sub_topic", ""),
-            question=question,
-            marks=entry.get("marks", 0),
-            year=entry.get("year", ""),
+        yield (
+            subject,
+            entry.get("sub_topic", ""),
+            question,
+            entry.get("marks", 0),
+            entry.get("year", ""),
         )
-        pyq_objects.append(pyq_obj)
 
+
+def _copy_pyq_rows(db: Session, rows: Iterator[Tuple]) -> int:
+    """
+    Stream rows into the pyqs table with PostgreSQL COPY, one batch at a time.
+    """
+    cursor = db.connection().connection.cursor()
+    inserted = 0
     try:
-        db.add_all(pyq_objects)
+        while True:
+            batch = list(islice(rows, COPY_BATCH_SIZE))
+            if not batch:
+                break
+            buf = io.StringIO()
+            csv.writer(buf).writerows(batch)
+            buf.seek(0)
+            cursor.copy_expert(PYQ_COPY_SQL, buf)
+            inserted += len(batch)
+    finally:
+        cursor.close()
+    return inserted
+
+
+def store_pyqs(db: Session, pyqs: Iterable[Dict], subject: str) -> int:
+    """
+    Store a list of PYQs in the database under the given subject.
+    Uses COPY FROM STDIN on PostgreSQL and a Core executemany INSERT elsewhere.
+    Returns the number of successfully inserted records.
+    """
+    rows = _iter_pyq_rows(pyqs, subject)
+
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            inserted = _copy_pyq_rows(db, rows)
+        else:
+            # Plain dicts straight to executemany - no ORM objects or unit-of-work
+            params = [dict(zip(PYQ_COLUMNS, row)) for row in rows]
+            if params:
+                db.execute(insert(models.PYQ), params)
+            inserted = len(params)
         db.commit()
-        return len(pyq_objects)
+        return inserted
     except Exception as e:
         db.rollback()
         print(f"Error storing PYQs: {e}")
         return 0
-
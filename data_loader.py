@@ -1,19 +1,59 @@
 import os
-import json
-from database import SessionLocal
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import ijson
+from database import SessionLocal, engine
 import crud
 
+# Number of PYQs parsed from the JSON stream before each insert
+LOAD_BATCH_SIZE = 500
 
-def load_pyqs_from_json(json_path: str, subject: str):
-    with open(json_path, "r", encoding="utf-8") as f:
-        pyqs = json.load(f)
 
+def batches(it, n: int = LOAD_BATCH_SIZE):
+    """Yield lists of up to n items from the iterator."""
+    it = iter(it)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+def load_pyqs_from_json(json_path: str, subject: str) -> bool:
+    """Insert a subject's PYQs (and embed them on PostgreSQL); returns False if either step failed."""
+    inserted = 0
     try:
-        with SessionLocal() as db:
-            crud.store_pyqs(db, pyqs, subject)
-        print(f"✅ Inserted {len(pyqs)} PYQs for subject: {subject}")
+        # ijson's C backend works on bytes, so open the file in binary mode
+        with open(json_path, "rb") as f, SessionLocal() as db:
+            for batch in batches(ijson.items(f, "item", use_float=True)):
+                inserted += crud.store_pyqs(db, batch, subject)
+            print(f"✅ Inserted {inserted} PYQs for subject: {subject}")
+            if db.get_bind().dialect.name != "postgresql":
+                return True
     except Exception as e:
         print(f"❌ Error inserting data for {subject}: {e}")
+        return False
+
+    try:
+        with SessionLocal() as db:
+            # Embed the new questions now so search can stay in SQL (pgvector). Imported
+            # here so plain inserts don't need OPENAI_API_KEY or the LangChain stack
+            from rag_pipeline import embed_missing_pyqs
+            embedded = embed_missing_pyqs(db, subject)
+            if embedded:
+                print(f"✅ Embedded {embedded} PYQs for subject: {subject}")
+    except Exception as e:
+        # Search for this subject stays on FAISS until every row has an embedding
+        print(f"❌ Error embedding PYQs for {subject} (retry with rag_pipeline.embed_missing_pyqs): {e}")
+        return False
+    return True
+
+
+def _load_one(args) -> bool:
+    """ProcessPoolExecutor entry point; each worker process uses its own engine and session."""
+    path, subject_name = args
+    print(f"📥 Loading {os.path.basename(path)} for subject: {subject_name}")
+    return load_pyqs_from_json(path, subject_name)
 
 
 if __name__ == "__main__":
@@ -29,8 +69,12 @@ if __name__ == "__main__":
         print("❌ No JSON files found in the 'subjects' folder.")
         exit(1)
 
-    for filename in json_files:
-        subject_name = os.path.splitext(filename)[0]
-        path = os.path.join(subjects_dir, filename)
-        print(f"📥 Loading {filename} for subject: {subject_name}")
-        load_pyqs_from_json(path, subject_name)
+    jobs = [(os.path.join(subjects_dir, f), os.path.splitext(f)[0]) for f in json_files]
+
+    # Subjects are independent, so parse and insert them in parallel; one connection
+    # per worker, capped by the pool size so we stay well under max_connections
+    max_workers = min(os.cpu_count() or 1, len(jobs), engine.pool.size())
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        results = list(ex.map(_load_one, jobs))
+    if not all(results):
+        exit(1)
@@ -1,24 +1,31 @@
 import os
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+import asyncio
+import threading
+from functools import lru_cache
+import re
+import json
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import tempfile
 import datetime
-from sqlalchemy.orm import sessionmaker
+import uuid
+from cachetools import TTLCache
+from sqlalchemy import select, func, tuple_
 from database import engine, SessionLocal
 from models import PDFHistory
-from utils import extract_text_from_pdf
-from rag_pipeline import infer_subtopic, get_relevant_pyqs
-from nltk.tokenize import sent_tokenize
+from utils import extract_text_from_pdf_parallel, build_page_text_index, find_fragment_quads
+from rag_pipeline import infer_subtopic, get_relevant_pyqs_cached
+import nltk.data
 try:
     from langchain_community.chat_models import ChatOpenAI
 except ImportError:
     from langchain.chat_models import ChatOpenAI
 import fitz  # PyMuPDF
-from PIL import Image
-from io import BytesIO
-import base64
+import httpx
+import openai
 from dotenv import load_dotenv
 
 # Load environment variables once
@@ -32,12 +39,29 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 # Set OpenAI API key
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * (1 << 20)
+UPLOAD_FORM_OVERHEAD_BYTES = 1 << 20  # room for the multipart boundaries and the subject field
+UPLOAD_READ_SIZE = 1 << 20  # copy uploads to disk 1 MiB at a time
+PDF_MAGIC = b"%PDF-"
+
+# History timestamps, e.g. "05 Mar, 2024 02:30 PM"; PostgreSQL formats them itself
+HISTORY_TIMESTAMP_FORMAT = '%d %b, %Y %I:%M %p'
+HISTORY_TIMESTAMP_PG_FORMAT = 'DD Mon, YYYY HH12:MI AM'
+
+# Rendered page PNGs served by /page-image: (job_id, chunk_index) -> png. Bounded by total
+# bytes, so the least recently used pages are evicted before PAGE_IMAGE_TTL if space runs out
+PAGE_IMAGE_TTL = int(os.getenv("PAGE_IMAGE_TTL", "1800"))
+PAGE_IMAGE_CACHE_BYTES = int(os.getenv("PAGE_IMAGE_CACHE_MB", "256")) * (1 << 20)
+PAGE_IMAGES = TTLCache(maxsize=PAGE_IMAGE_CACHE_BYTES, ttl=PAGE_IMAGE_TTL, getsizeof=len)
+
 # Single FastAPI app initialization with environment-specific settings
 app = FastAPI(
     title="IntelliJect API", 
     description="Smart PYQ-PDF Enhancer API",
     docs_url="/docs" if ENVIRONMENT != "production" else None,
-    redoc_url="/redoc" if ENVIRONMENT != "production" else None
+    redoc_url="/redoc" if ENVIRONMENT != "production" else None,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -49,8 +73,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database session
-SessionLocal = sessionmaker(bind=engine)
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"PDF exceeds the {MAX_UPLOAD_BYTES // (1 << 20)} MB upload limit"
+    )
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    """
+    Reject oversized uploads from their Content-Length, before Starlette reads and spools
+    the multipart body - this is where the upload limit actually bounds memory and disk.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+            error = upload_too_large()
+            return ORJSONResponse(status_code=error.status_code, content={"detail": error.detail})
+    return await call_next(request)
 
 class PDFResponse(BaseModel):
     success: bool
@@ -61,7 +101,7 @@ class ChunkData(BaseModel):
     chunk_index: int
     subtopic: str
     questions: List[Dict[str, Any]]
-    highlighted_image: str  # base64 encoded image
+    image_url: str  # /page-image/{job_id}/{chunk_index}, empty if the page could not be rendered
     answers_highlighted: List[str]
 
 class ProcessedPDFResponse(BaseModel):
@@ -78,8 +118,25 @@ class HistoryItem(BaseModel):
 class HistoryResponse(BaseModel):
     success: bool
     history: List[HistoryItem]
+    next_cursor: Optional[str] = None  # opaque "<timestamp>,<id>"; pass as ?before= to fetch the next page
+
+# Keep-alive connection pool to api.openai.com shared by every answer-extraction call
+_HTTPX = httpx.AsyncClient(
+    timeout=60,
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+)
+
+# Shared LLM client - building one per call re-validates settings and opens a new HTTP client.
+# ChatOpenAI's http_client is handed to both the sync and async OpenAI clients, so the
+# pooled AsyncClient goes in through a prebuilt async_client instead; sync calls keep
+# openai's own default client.
+_LLM = ChatOpenAI(
+    temperature=0,
+    model="gpt-3.5-turbo",
+    async_client=openai.AsyncOpenAI(http_client=_HTTPX).chat.completions
+)
 
-def extract_answer_from_chunk(chunk: str, question: str) -> str:
+async def extract_answer_from_chunk_async(chunk: str, question: str) -> str:
     """Extract answer from chunk using OpenAI LLM - same logic as in Streamlit"""
     prompt = f"""
 Given the following notes and a question, extract the exact sentence(s) from the notes that directly answer the question if possible. Only return the excerpt(s), not any explanation.
@@ -93,13 +150,192 @@ Question:
 Answer/excerpt:
 """
     try:
-        llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-        answer = llm.predict(prompt).strip()
-        return answer
+        answer = await _LLM.apredict(prompt)
+        return answer.strip()
     except Exception as e:
         print(f"Error extracting answer: {e}")
         return ""
 
+# A sentence terminator followed by more text means the excerpt has several sentences
+_SENTENCE_BREAK = re.compile(r"[.!?]\s+\S")
+
+@lru_cache(maxsize=None)
+def _punkt_tokenizer():
+    """Load the English Punkt model once instead of resolving it on every sent_tokenize() call"""
+    return nltk.data.load("tokenizers/punkt/english.pickle")
+
+def split_answer_fragments(answer_text: str) -> List[str]:
+    """Split an LLM excerpt into sentences so each can be highlighted on its own"""
+    if not _SENTENCE_BREAK.search(answer_text):
+        return [answer_text]  # single sentence - nothing to tokenize
+    return _punkt_tokenizer().tokenize(answer_text)
+
+def dedupe_fragments(fragments: List[str]) -> List[str]:
+    """Drop repeated fragments (ignoring case and whitespace), keeping first-seen order"""
+    unique = {}
+    for frag in fragments:
+        key = " ".join(frag.lower().split())
+        if key and key not in unique:
+            unique[key] = frag
+    return list(unique.values())
+
+# Maximum number of chunks processed concurrently in /process-pdf
+CHUNK_CONCURRENCY = 8
+
+def render_highlighted_page(pdf_doc, pdf_lock, page_index: int, fragments: List[str]) -> bytes:
+    """Highlight answer fragments on a page and return it as PNG bytes"""
+    # PyMuPDF documents are not thread-safe, so page work is serialised
+    with pdf_lock:
+        page = pdf_doc[page_index]
+        # Extract the page text once and match every fragment against it
+        page_text, char_boxes = build_page_text_index(page)
+        for answer_frag in fragments:
+            quads = find_fragment_quads(page_text, char_boxes, answer_frag)
+            if quads:
+                page.add_highlight_annot(quads)
+        
+        # Highlights need colour, so stay RGB but drop alpha and render at 110 dpi;
+        # MuPDF encodes the PNG itself, skipping the PIL round-trip
+        pix = page.get_pixmap(dpi=110, colorspace=fitz.csRGB, alpha=False)
+        return pix.tobytes("png")
+
+def find_relevant_pyqs(db, db_lock, chunk: str, subject: str):
+    """Blocking PYQ retrieval for a chunk on the request's shared session, run in a worker thread"""
+    # A Session is not thread-safe, so concurrent chunks take turns running SQL on it;
+    # the embedding round-trips and vector search run outside db_lock and still overlap
+    return get_relevant_pyqs_cached(db, chunk, subject, db_lock=db_lock)
+
+async def process_chunk(i: int, chunk: str, subject: str, pdf_doc, pdf_lock, db, db_lock, job_id: str) -> ChunkData:
+    """Run the subtopic / PYQ / answer / highlight pipeline for one chunk"""
+    # Subtopic inference and PYQ retrieval are independent blocking calls
+    subtopic, related_qs = await asyncio.gather(
+        asyncio.to_thread(infer_subtopic, chunk),
+        asyncio.to_thread(find_relevant_pyqs, db, db_lock, chunk, subject),
+    )
+    
+    # Ask for every question's excerpt at once instead of one round-trip at a time
+    tasks = [extract_answer_from_chunk_async(chunk, q.page_content) for q in related_qs]
+    answers = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    questions_data = []
+    answers_to_highlight = []
+    for q, answer_text in zip(related_qs, answers):
+        if isinstance(answer_text, BaseException):
+            answer_text = ""
+        questions_data.append({
+            "question": q.page_content,
+            "sub_topic": q.metadata.get("sub_topic", ""),
+            "marks": q.metadata.get("marks", ""),
+            "year": q.metadata.get("year", ""),
+            "answer": answer_text,
+        })
+        if answer_text:
+            answers_to_highlight.extend(split_answer_fragments(answer_text))
+    
+    # Several questions often return the same sentence - highlight it once
+    answers_to_highlight = dedupe_fragments(answers_to_highlight)
+    
+    # Highlight answers on the matching PDF page; the PNG is served by /page-image
+    image_url = ""
+    if i < len(pdf_doc):
+        png_bytes = await asyncio.to_thread(
+            render_highlighted_page, pdf_doc, pdf_lock, i, answers_to_highlight
+        )
+        try:
+            PAGE_IMAGES[(job_id, i)] = png_bytes
+            image_url = f"/page-image/{job_id}/{i}"
+        except ValueError:
+            print(f"Page {i + 1} image exceeds the page image cache size")
+    
+    return ChunkData(
+        chunk_index=i,
+        subtopic=subtopic,
+        questions=questions_data,
+        image_url=image_url,
+        answers_highlighted=answers_to_highlight
+    )
+
+def record_pdf_upload(filename: str, subject: str) -> None:
+    """Insert a history row with a Core INSERT, skipping the ORM session and flush"""
+    with engine.begin() as conn:
+        conn.execute(PDFHistory.__table__.insert().values(
+            filename=filename,
+            subject=subject,
+            timestamp=datetime.datetime.utcnow()
+        ))
+
+def copy_upload_to_tempfile(src) -> str:
+    """
+    Blocking copy of an upload's (already spooled) file object to a named temp file in
+    UPLOAD_READ_SIZE pieces; returns its path. PyMuPDF and the extraction pool need a path,
+    and Starlette's spool file has none once it rolls over to disk.
+    Stops copying at a missing %PDF- header or once MAX_UPLOAD_BYTES is exceeded; the latter
+    only matters for chunked requests, since limit_upload_size checks Content-Length first.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_pdf_path = tmp_file.name
+        try:
+            header = src.read(len(PDF_MAGIC))
+            if header != PDF_MAGIC:
+                raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
+            tmp_file.write(header)
+            total = len(header)
+            while True:
+                block = src.read(UPLOAD_READ_SIZE)
+                if not block:
+                    break
+                total += len(block)
+                if total > MAX_UPLOAD_BYTES:
+                    raise upload_too_large()
+                tmp_file.write(block)
+        except BaseException:
+            tmp_file.close()
+            os.unlink(tmp_pdf_path)
+            raise
+    return tmp_pdf_path
+
+async def save_upload_to_tempfile(file: UploadFile) -> str:
+    """Copy an upload to a temp file without blocking the event loop and return its path"""
+    # Starlette already knows the spooled size, so skip the copy for files over the limit
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise upload_too_large()
+    # One worker-thread hop for the whole copy rather than one per UploadFile.read() block
+    await file.seek(0)
+    return await asyncio.to_thread(copy_upload_to_tempfile, file.file)
+
+def open_pdf_file(tmp_pdf_path: str):
+    """
+    Parse a saved upload with PyMuPDF and extract its per-page text, then remove the temp file.
+    Returns (pdf_doc, text_chunks); raises HTTPException if the file can't be used.
+    """
+    try:
+        try:
+            # Parse the upload once and reuse the document for text and highlighting
+            pdf_doc = fitz.open(tmp_pdf_path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not open the PDF: {e}")
+        
+        try:
+            # Extract text chunks (one per page) - same logic as in Streamlit
+            # Large PDFs are fanned out to a process pool, whose workers read the file by path
+            text_chunks = extract_text_from_pdf_parallel(pdf_doc, tmp_pdf_path)
+        except Exception as e:
+            pdf_doc.close()
+            raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
+    finally:
+        # MuPDF keeps its own handle, so the path can go right away
+        os.unlink(tmp_pdf_path)
+    
+    return pdf_doc, text_chunks
+
+def pdf_page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await _HTTPX.aclose()
+
 @app.get("/", response_model=Dict[str, str])
 async def root():
     return {"message": "IntelliJect API is running"}
@@ -110,19 +346,44 @@ async def health_check():
     return {"status": "healthy", "environment": ENVIRONMENT}
 
 @app.get("/history", response_model=HistoryResponse)
-async def get_pdf_history():
-    """Get PDF upload history - same logic as sidebar in Streamlit"""
+async def get_pdf_history(
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+):
+    """Get PDF upload history, newest first, one page at a time - same logic as sidebar in Streamlit"""
+    before_key = None
+    if before is not None:
+        # Cursor is the (timestamp, id) of the previous page's last row
+        try:
+            before_ts, before_id = before.rsplit(",", 1)
+            before_key = (datetime.datetime.fromisoformat(before_ts), int(before_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid history cursor")
+    
     try:
         with SessionLocal() as db:
-            pdfs = db.query(PDFHistory).order_by(PDFHistory.timestamp.desc()).all()
-            history_items = []
-            for pdf in pdfs:
-                history_items.append(HistoryItem(
-                    filename=pdf.filename,
-                    subject=pdf.subject,
-                    timestamp=pdf.timestamp.strftime('%d %b, %Y %I:%M %p')
-                ))
-            return HistoryResponse(success=True, history=history_items)
+            # Keyset pagination on (timestamp, id) - the id breaks ties between rows with the same
+            # timestamp at a page boundary; selecting only the displayed columns lets
+            # idx_pdf_history_ts_id_covering answer it without loading ORM objects
+            format_in_db = db.get_bind().dialect.name == "postgresql"
+            columns = [PDFHistory.id, PDFHistory.filename, PDFHistory.subject, PDFHistory.timestamp]
+            if format_in_db:
+                columns.append(func.to_char(PDFHistory.timestamp, HISTORY_TIMESTAMP_PG_FORMAT).label("ts"))
+            stmt = select(*columns)
+            if before_key is not None:
+                stmt = stmt.where(tuple_(PDFHistory.timestamp, PDFHistory.id) < tuple_(*before_key))
+            stmt = stmt.order_by(PDFHistory.timestamp.desc(), PDFHistory.id.desc()).limit(limit)
+            rows = db.execute(stmt).all()
+            history_items = [
+                HistoryItem(
+                    filename=row.filename,
+                    subject=row.subject,
+                    timestamp=row.ts if format_in_db else row.timestamp.strftime(HISTORY_TIMESTAMP_FORMAT)
+                )
+                for row in rows
+            ]
+            next_cursor = f"{rows[-1].timestamp.isoformat()},{rows[-1].id}" if len(rows) == limit else None
+            return HistoryResponse(success=True, history=history_items, next_cursor=next_cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not load PDF history: {e}")
 
@@ -133,26 +394,17 @@ async def upload_pdf(file: UploadFile = File(...), subject: str = Form(...)):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
     # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        content = await file.read()
-        tmp_file.write(content)
-        tmp_pdf_path = tmp_file.name
+    tmp_pdf_path = await save_upload_to_tempfile(file)
     
     try:
-        # Save to database - same logic as in Streamlit
-        with SessionLocal() as db:
-            history = PDFHistory(
-                filename=file.filename,
-                subject=subject,
-                timestamp=datetime.datetime.utcnow()
-            )
-            db.add(history)
-            db.commit()
+        # Save to database off the event loop - same logic as in Streamlit
+        await asyncio.to_thread(record_pdf_upload, file.filename, subject)
         
         # Extract text chunks - same logic as in Streamlit
-        text_chunks = extract_text_from_pdf(tmp_pdf_path)
+        # One chunk per page, so the page count is the chunk count - no text extraction needed
+        chunks_count = await asyncio.to_thread(pdf_page_count, tmp_pdf_path)
         
-        if not text_chunks:
+        if not chunks_count:
             os.unlink(tmp_pdf_path)  # Clean up temp file
             raise HTTPException(status_code=400, detail="Could not extract content from the PDF")
         
@@ -162,7 +414,7 @@ async def upload_pdf(file: UploadFile = File(...), subject: str = Form(...)):
         return PDFResponse(
             success=True, 
             message=f"PDF '{file.filename}' uploaded successfully",
-            chunks_count=len(text_chunks)
+            chunks_count=chunks_count
         )
     
     except Exception as e:
@@ -171,6 +423,107 @@ async def upload_pdf(file: UploadFile = File(...), subject: str = Form(...)):
             os.unlink(tmp_pdf_path)
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
 
+async def open_uploaded_pdf(file: UploadFile):
+    """Validate an uploaded PDF and return the open document with its per-page text chunks"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    tmp_pdf_path = await save_upload_to_tempfile(file)
+    
+    # Parsing and extraction are CPU-bound, so keep them off the event loop
+    pdf_doc, text_chunks = await asyncio.to_thread(open_pdf_file, tmp_pdf_path)
+    
+    if not text_chunks:
+        pdf_doc.close()
+        raise HTTPException(status_code=400, detail="Could not extract content from the PDF")
+    
+    return pdf_doc, text_chunks
+
+async def process_chunks_async(pdf_doc, text_chunks: List[str], subject: str):
+    """
+    Process all chunks concurrently (at most CHUNK_CONCURRENCY at a time) and yield
+    their ChunkData in chunk order. Takes ownership of pdf_doc and closes it when done.
+    """
+    pdf_lock = threading.Lock()
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+    # One session (and at most one pooled connection) for the whole request
+    db = SessionLocal()
+    db_lock = threading.Lock()
+    # Page images for this request are stored in PAGE_IMAGES under this id
+    job_id = uuid.uuid4().hex
+    
+    async def bounded_process_chunk(i: int, chunk: str) -> ChunkData:
+        async with semaphore:
+            return await process_chunk(i, chunk, subject, pdf_doc, pdf_lock, db, db_lock, job_id)
+    
+    tasks = [asyncio.create_task(bounded_process_chunk(i, chunk)) for i, chunk in enumerate(text_chunks)]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        # Stop outstanding work if the consumer went away or a chunk failed
+        for task in tasks:
+            task.cancel()
+        with pdf_lock:
+            pdf_doc.close()
+        with db_lock:
+            db.close()
+
 @app.post("/process-pdf", response_model=ProcessedPDFResponse)
 async def process_pdf(file: UploadFile = File(...), subject: str = Form(...)):
-    """Process PDF and return all chunk
+    """Process PDF and return all chunk data with highlighted page image URLs - same logic as in Streamlit"""
+    pdf_doc, text_chunks = await open_uploaded_pdf(file)
+    
+    try:
+        chunk_data_list = [
+            chunk_data async for chunk_data in process_chunks_async(pdf_doc, text_chunks, subject)
+        ]
+        
+        # Serialize directly with orjson; returning the model would re-validate and
+        # re-encode every chunk through jsonable_encoder
+        return ORJSONResponse(content=ProcessedPDFResponse(
+            success=True,
+            message=f"Successfully processed {len(text_chunks)} chunks",
+            total_chunks=len(text_chunks),
+            chunk_data=chunk_data_list
+        ).model_dump())
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {e}")
+
+@app.post("/process-pdf/stream")
+async def process_pdf_stream(file: UploadFile = File(...), subject: str = Form(...)):
+    """
+    Same processing as /process-pdf, streamed as NDJSON: a {"type": "meta", "total": N} line,
+    then one ChunkData line per chunk as soon as it is ready (in chunk order).
+    A failure mid-stream is reported as a final {"type": "error", "detail": ...} line.
+    """
+    pdf_doc, text_chunks = await open_uploaded_pdf(file)
+    
+    async def generate():
+        yield json.dumps({"type": "meta", "total": len(text_chunks)}) + "\n"
+        try:
+            async for chunk_data in process_chunks_async(pdf_doc, text_chunks, subject):
+                yield chunk_data.model_dump_json() + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": f"Failed to process PDF: {e}"}) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/page-image/{job_id}/{chunk_index}")
+async def get_page_image(job_id: str, chunk_index: int):
+    """Highlighted page PNG for a chunk of a recent /process-pdf job"""
+    png_bytes = PAGE_IMAGES.get((job_id, chunk_index))
+    if png_bytes is None:
+        raise HTTPException(status_code=404, detail="Page image not found or expired")
+    return Response(
+        content=png_bytes,
+        media_type="image/png",
+        headers={"Cache-Control": f"private, max-age={PAGE_IMAGE_TTL}"}
+    )
+
+if __name__ == "__main__":
+    import uvicorn
+    # uvloop event loop + httptools parser (both ship with uvicorn[standard]); keep a single
+    # worker because PAGE_IMAGES and the retrieval caches are per process
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")), loop="uvloop", http="httptools")
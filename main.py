@@ -1,8 +1,8 @@
 import streamlit as st
 import requests
-from PIL import Image
-from io import BytesIO
-import base64
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+import orjson
 
 # Configure the API base URL - try different options if localhost doesn't work
 API_BASE_URL = "http://127.0.0.1:8000"  # Changed to match error message
@@ -13,17 +13,23 @@ API_BASE_URL = "http://127.0.0.1:8000"  # Changed to match error message
 st.set_page_config(page_title="IntelliJect", layout="wide")
 st.title("🧠 IntelliJect: Smart PYQ-PDF Enhancer")
 
-# Test API connection
-@st.cache_data(ttl=60)  # Cache for 1 minute
-def test_api_connection():
-    try:
-        response = requests.get(f"{API_BASE_URL}/", timeout=5)
-        return response.status_code == 200
-    except:
-        return False
+# One keep-alive HTTP session per API URL shared across reruns, so each API call reuses
+# the open TCP connection; it is only cached once the API has answered, so the
+# connection check runs once per server process instead of on every rerun
+@st.cache_resource
+def api_session(base_url: str = API_BASE_URL):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    response = session.get(f"{base_url}/", timeout=5)
+    response.raise_for_status()
+    return session
 
 # Show connection status
-if not test_api_connection():
+try:
+    api_session()
+except Exception:
     st.error(f"⚠ Cannot connect to API server at {API_BASE_URL}. Please make sure the FastAPI server is running.")
     st.info("To start the API server, run: python main.py in a separate terminal")
     st.stop()
@@ -57,9 +63,9 @@ st.markdown("""
 def get_pdf_history():
     """Fetch PDF history from API"""
     try:
-        response = requests.get(f"{API_BASE_URL}/history")
+        response = api_session().get(f"{API_BASE_URL}/history")
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             return {"success": False, "history": []}
     except Exception as e:
@@ -67,37 +73,79 @@ def get_pdf_history():
         return {"success": False, "history": []}
 
 def process_pdf_with_api(uploaded_file, subject):
-    """Process PDF using the API"""
+    """Process PDF using the API, yielding each NDJSON record as the server streams it"""
     try:
-        files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
-        data = {"subject": subject}
+        # Stream the multipart body from the uploaded file object instead of
+        # copying it into memory with getvalue() and again into the request body
+        uploaded_file.seek(0)
+        encoder = MultipartEncoder(fields={
+            "file": (uploaded_file.name, uploaded_file, "application/pdf"),
+            "subject": subject,
+        })
         
         # Add timeout and better error handling
-        response = requests.post(
-            f"{API_BASE_URL}/process-pdf", 
-            files=files, 
-            data=data, 
-            timeout=300  # 5 minutes timeout
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            try:
-                error_detail = response.json().get("detail", "Unknown error")
-            except:
-                error_detail = f"HTTP {response.status_code}: {response.text}"
-            st.error(f"API Error: {error_detail}")
-            return None
+        with api_session().post(
+            f"{API_BASE_URL}/process-pdf/stream", 
+            data=encoder, 
+            headers={"Content-Type": encoder.content_type}, 
+            timeout=300,  # 5 minutes without data
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                try:
+                    error_detail = response.json().get("detail", "Unknown error")
+                except:
+                    error_detail = f"HTTP {response.status_code}: {response.text}"
+                st.error(f"API Error: {error_detail}")
+                return
+            
+            # One JSON object per line: a meta record, then one record per chunk
+            for line in response.iter_lines():
+                if line:
+                    yield orjson.loads(line)
     except requests.exceptions.Timeout:
         st.error("Request timed out. The PDF might be too large or complex.")
-        return None
     except requests.exceptions.ConnectionError:
         st.error(f"Cannot connect to API server at {API_BASE_URL}. Make sure the FastAPI server is running.")
-        return None
     except Exception as e:
         st.error(f"Failed to process PDF: {e}")
-        return None
+
+def render_chunk(chunk_data):
+    """Show one processed chunk: highlighted page image next to its PYQs (same UI as before)"""
+    col_img, col_pyqs = st.columns([1.5, 1])
+    
+    with col_pyqs:
+        st.markdown(f"<span style='font-size:20px;font-weight:bold;'>🔎 Subtopic: {chunk_data['subtopic']}</span>", unsafe_allow_html=True)
+        
+        if chunk_data["questions"]:
+            for q_data in chunk_data["questions"]:
+                st.markdown(
+                    f"<div class='question-card'>"
+                    f"❓ <b>Q:</b> {q_data['question']}<br>"
+                    f"<span style='font-size:14px;opacity:0.8;'>"
+                    f"🧩 Topic: {q_data['sub_topic']} | "
+                    f"📝 Marks: {q_data['marks']} | "
+                    f"📅 {q_data['year']}"
+                    f"</span><br>"
+                    f"<span class='highlight-answer'><b>📌 Answer:</b> {q_data['answer']}</span>"
+                    f"</div>", unsafe_allow_html=True
+                )
+                st.markdown("---", unsafe_allow_html=True)
+        else:
+            st.info("❗ No relevant PYQs found for this chunk.")
+    
+    with col_img:
+        try:
+            if chunk_data["image_url"]:
+                # Raw PNG served by the API, fetched here on the Streamlit server so
+                # viewers' browsers never need to reach the API host
+                response = api_session().get(f"{API_BASE_URL}{chunk_data['image_url']}", timeout=30)
+                response.raise_for_status()
+                st.image(response.content, caption=f"PDF Page {chunk_data['chunk_index']+1} (Highlighted Answers)", use_container_width=True)
+            else:
+                st.warning(f"Could not render PDF page {chunk_data['chunk_index']+1} image")
+        except Exception as e:
+            st.warning(f"Could not display image for chunk {chunk_data['chunk_index']+1}: {e}")
 
 # Sidebar - PDF History (same UI as before)
 with st.sidebar:
@@ -126,76 +174,42 @@ if uploaded_file and subject:
     # Show progress and status
     progress_bar = st.progress(0)
     status_text = st.empty()
+    summary = st.empty()  # keeps the final status above the streamed chunks
     
-    # Process PDF using API
+    # Process PDF using API, rendering each chunk as soon as it arrives
     try:
-        status_text.text("🔄 Connecting to API server...")
+        status_text.text("📤 Uploading PDF to server...")
         progress_bar.progress(10)
         
-        status_text.text("📤 Uploading PDF to server...")
-        progress_bar.progress(30)
+        total_chunks = 0
+        processed_chunks = 0
+        stream_error = None
         
-        status_text.text("🔍 Extracting and analyzing content...")
-        progress_bar.progress(50)
+        for record in process_pdf_with_api(uploaded_file, subject):
+            record_type = record.get("type")
+            if record_type == "meta":
+                total_chunks = record["total"]
+                status_text.text(f"🔍 Extracting and analyzing {total_chunks} chunks...")
+            elif record_type == "error":
+                stream_error = record["detail"]
+            else:
+                processed_chunks += 1
+                progress_bar.progress(10 + int(90 * processed_chunks / max(total_chunks, 1)))
+                status_text.text(f"🔍 Analyzed {processed_chunks} of {total_chunks} chunks...")
+                render_chunk(record)
         
-        result = process_pdf_with_api(uploaded_file, subject)
+        # Clear progress indicators
+        progress_bar.empty()
+        status_text.empty()
         
-        if result and result["success"]:
-            progress_bar.progress(100)
-            status_text.text("✅ Processing complete!")
-            st.success(f"✅ Successfully processed {result['total_chunks']} chunks.")
-            
-            # Clear progress indicators
-            progress_bar.empty()
-            status_text.empty()
-            
-            pdf_doc = None
-            num_pages = result['total_chunks']
-            
-            if result['total_chunks'] != num_pages:
-                st.warning(f"⚠ Number of text chunks ({result['total_chunks']}) may not match number of PDF pages. Highlighting may be inaccurate.")
-            
-            # Display results for each chunk (same UI as before)
-            for chunk_data in result["chunk_data"]:
-                col_img, col_pyqs = st.columns([1.5, 1])
-                
-                with col_pyqs:
-                    st.markdown(f"<span style='font-size:20px;font-weight:bold;'>🔎 Subtopic: {chunk_data['subtopic']}</span>", unsafe_allow_html=True)
-                    
-                    if chunk_data["questions"]:
-                        for q_data in chunk_data["questions"]:
-                            st.markdown(
-                                f"<div class='question-card'>"
-                                f"❓ <b>Q:</b> {q_data['question']}<br>"
-                                f"<span style='font-size:14px;opacity:0.8;'>"
-                                f"🧩 Topic: {q_data['sub_topic']} | "
-                                f"📝 Marks: {q_data['marks']} | "
-                                f"📅 {q_data['year']}"
-                                f"</span><br>"
-                                f"<span class='highlight-answer'><b>📌 Answer:</b> {q_data['answer']}</span>"
-                                f"</div>", unsafe_allow_html=True
-                            )
-                            st.markdown("---", unsafe_allow_html=True)
-                    else:
-                        st.info("❗ No relevant PYQs found for this chunk.")
-                
-                with col_img:
-                    try:
-                        if chunk_data["highlighted_image"]:
-                            # Decode base64 image
-                            img_data = base64.b64decode(chunk_data["highlighted_image"])
-                            img = Image.open(BytesIO(img_data))
-                            st.image(img, caption=f"PDF Page {chunk_data['chunk_index']+1} (Highlighted Answers)", use_container_width=True)
-                        else:
-                            st.warning(f"Could not render PDF page {chunk_data['chunk_index']+1} image")
-                    except Exception as e:
-                        st.warning(f"Could not display image for chunk {chunk_data['chunk_index']+1}: {e}")
+        if stream_error:
+            summary.error(f"❌ {stream_error}")
+        elif processed_chunks:
+            summary.success(f"✅ Successfully processed {processed_chunks} chunks.")
         else:
-            progress_bar.empty()
-            status_text.empty()
-            st.error("❌ Failed to process PDF.")
+            summary.error("❌ Failed to process PDF.")
     
     except Exception as e:
         progress_bar.empty()
         status_text.empty()
-        st.error(f"❌ Unexpected error: {e}")
\ No newline at end of file
+        st.error(f"❌ Unexpected error: {e}")
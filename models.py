@@ -1,9 +1,24 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
-from datetime import datetime
-from database import Base
+from sqlalchemy import Column, Integer, String, Float, Index
+from sqlalchemy.orm import deferred
+from pgvector.sqlalchemy import Vector
+from database import Base, PDFHistory  # noqa: F401 - PDFHistory is defined in database.py
+
+# OpenAIEmbeddings (text-embedding-ada-002) vector size
+EMBEDDING_DIM = 1536
 
 class PYQ(Base):
     __tablename__ = "pyqs"
+    __table_args__ = (
+        # get_pyqs_by_subject / vectorstore filter, and subject + sub_topic lookups
+        Index("ix_pyq_subject_subtopic", "subject", "sub_topic"),
+        # ANN index for ORDER BY embedding <=> :q; pgvector only
+        Index(
+            "idx_pyq_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     question = Column(String, index=True)
@@ -14,12 +29,6 @@ class PYQ(Base):
     marks = Column(Float)  # To support 2.5 marks
     sub_topic = Column(String, index=True)
     subject = Column(String, nullable=False)
-
-class PDFHistory(Base):
-    __tablename__ = "pdf_history"
-    __table_args__ = {'extend_existing': True}  # ✅ Fix here
-
-    id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String)
-    subject = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    # Question embedding, filled in by rag_pipeline.embed_missing_pyqs(); deferred so
+    # plain PYQ queries don't pull 1536 floats per row
+    embedding = deferred(Column(Vector(EMBEDDING_DIM)))
@@ -1,6 +1,17 @@
 import os
-from typing import List
+import re
+import shutil
+import asyncio
+import hashlib
+import sqlite3
+from contextlib import closing, nullcontext
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
+import diskcache
+from cachetools import TTLCache
+from blingfire import text_to_sentences_and_offsets
 
 # Updated imports to fix LangChain deprecation warnings
 try:
@@ -14,29 +25,89 @@ except ImportError:
     from langchain.chat_models import ChatOpenAI
 
 from langchain.docstore.document import Document
+from langchain.schema import HumanMessage, SystemMessage
+from langchain.docstore.in_memory import InMemoryDocstore
+import faiss
+import numpy as np
 
+from sqlalchemy import exists, func, select, update
 from sqlalchemy.orm import Session
-from models import PYQ
+from models import PYQ, EMBEDDING_DIM
 
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
 embedding = OpenAIEmbeddings()
 
+# PYQs embedded per embed_documents() request when backfilling PYQ.embedding
+EMBED_BATCH_SIZE = 500
 
-def load_vectorstore_from_db(session: Session, subject: str = None) -> FAISS:
+# HNSW candidate list size for pgvector searches. The subject filter is applied after the
+# index scan, so the default of 40 can come back short once other subjects dominate the graph
+HNSW_EF_SEARCH = 200
+
+# Subjects (None = all) known to have embedded PYQs; once backfilled they stay that way
+
+
+def _db_guard(db_lock=None):
     """
-    Dynamically builds a FAISS vectorstore from PYQs stored in the database for the given subject.
+    Hold db_lock around statements on a session shared between worker threads; callers keep
+    embedding calls and vector search outside it so they still overlap. No-op without a lock.
     """
-    query_set = session.query(PYQ)
+    return db_lock if db_lock is not None else nullcontext()
+
+
+def _use_pgvector(session: Session) -> bool:
+    """PYQ.embedding is searched in SQL on PostgreSQL (pgvector); other databases use FAISS."""
+    return session.get_bind().dialect.name == "postgresql"
+
+
+def _pgvector_ready(session: Session, subject: str = None) -> bool:
+    """
+    True when the subject's PYQs can be searched with pgvector: PostgreSQL, and every row has
+    been embedded. Rows inserted since the last embed_missing_pyqs() run would otherwise be
+    invisible to the SQL search, so the subject stays on FAISS until they are filled.
+    """
+    if not _use_pgvector(session):
+        return False
+
+    has_embedded = exists().where(PYQ.embedding.is_not(None))
+    has_missing = exists().where(PYQ.embedding.is_(None))
     if subject:
-        query_set = query_set.filter(PYQ.subject == subject)
+        has_embedded = has_embedded.where(PYQ.subject == subject)
+        has_missing = has_missing.where(PYQ.subject == subject)
+    embedded, missing = session.execute(select(has_embedded, has_missing)).one()
+    return bool(embedded and not missing)
 
-    pyqs = query_set.all()
-    if not pyqs:
-        return None  # No data to build vector store
-    docs = [
-    Document(
+
+def embed_missing_pyqs(session: Session, subject: str = None) -> int:
+    """
+    Fill PYQ.embedding for rows that don't have one yet, EMBED_BATCH_SIZE questions per request.
+    Only needed on PostgreSQL; returns the number of PYQs embedded.
+    """
+    if not _use_pgvector(session):
+        return 0
+
+    stmt = select(PYQ.id, PYQ.question).where(PYQ.embedding.is_(None))
+    if subject:
+        stmt = stmt.where(PYQ.subject == subject)
+    rows = session.execute(stmt.order_by(PYQ.id)).all()
+
+    embedded = 0
+    for start in range(0, len(rows), EMBED_BATCH_SIZE):
+        batch = rows[start:start + EMBED_BATCH_SIZE]
+        vectors = embedding.embed_documents([row.question or "" for row in batch])
+        session.execute(
+            update(PYQ),
+            [{"id": row.id, "embedding": vector} for row, vector in zip(batch, vectors)]
+        )
+        session.commit()
+        embedded += len(batch)
+    return embedded
+
+
+def _pyq_to_document(pyq: PYQ) -> Document:
+    return Document(
         page_content=pyq.question,
         metadata={
             "year": pyq.year,
@@ -45,17 +116,262 @@ def load_vectorstore_from_db(session: Session, subject: str = None) -> FAISS:
             "marks": pyq.marks
         }
     )
-    for pyq in pyqs
-    ]
-    vectorstore = FAISS.from_documents(docs, embedding)
-    return vectorstore
 
 
-def semantic_search_db(session: Session, query: str, subject: str = None, k: int = 5) -> List[Document]:
+def search_pyqs_by_vector(session: Session, vector: List[float], subject: str = None, k: int = 5) -> List[Document]:
+    """
+    Top-k PYQs by cosine distance to vector, computed in PostgreSQL (uses the HNSW index).
+    """
+    # Transaction-local, like SET LOCAL; set_config takes the value as a bind parameter
+    session.execute(select(func.set_config("hnsw.ef_search", str(HNSW_EF_SEARCH), True)))
+    stmt = select(PYQ).where(PYQ.embedding.is_not(None))
+    if subject:
+        stmt = stmt.where(PYQ.subject == subject)
+    stmt = stmt.order_by(PYQ.embedding.cosine_distance(vector)).limit(k)
+    return [_pyq_to_document(pyq) for pyq in session.scalars(stmt).all()]
+
+
+# Built vectorstores keyed by (subject, PYQ table version); saved to disk so a
+# restarted process can skip re-embedding an unchanged corpus
+FAISS_CACHE_DIR = os.getenv("FAISS_CACHE_DIR", ".faiss_cache")
+_VS_CACHE: Dict[Tuple[Optional[str], tuple], FAISS] = {}
+_VS_CACHE_LOCK = threading.Lock()  # guards _VS_CACHE and _VS_BUILD_LOCKS, never held while building
+_VS_BUILD_LOCKS: Dict[Optional[str], threading.Lock] = {}
+PYQ_VERSION_SCAN_SIZE = 1000  # rows per fetch while digesting a subject's PYQs
+
+
+def _pyq_table_version(session: Session, subject: str = None) -> tuple:
+    """
+    Version token for the subject's PYQs: (max id, row count, content digest). The digest covers
+    every field that ends up in the vectorstore, so editing a question in place changes it too.
+    """
+    stmt = select(PYQ.id, PYQ.question, PYQ.year, PYQ.sub_topic, PYQ.marks).order_by(PYQ.id)
+    if subject:
+        stmt = stmt.where(PYQ.subject == subject)
+
+    digest = hashlib.blake2b(digest_size=8)
+    max_id, count = None, 0
+    for row in session.execute(stmt.execution_options(yield_per=PYQ_VERSION_SCAN_SIZE)):
+        digest.update(repr(tuple(row)).encode("utf-8"))
+        max_id, count = row.id, count + 1
+    return max_id, count, digest.hexdigest()
+
+
+# Hot-path callers reuse the version for a few seconds instead of re-running the aggregate
+# on every chunk; PYQs loaded by another process show up within PYQ_VERSION_TTL seconds
+PYQ_VERSION_TTL = float(os.getenv("PYQ_VERSION_TTL", "30"))
+_pyq_version_cache = TTLCache(maxsize=1024, ttl=PYQ_VERSION_TTL)
+_pyq_version_lock = threading.Lock()
+
+
+def _cached_pyq_table_version(session: Session, subject: str = None, db_lock=None) -> tuple:
+    """_pyq_table_version(), served from a short-lived per-subject cache."""
+    with _pyq_version_lock:
+        version = _pyq_version_cache.get(subject)
+    if version is None:
+        with _db_guard(db_lock):
+            version = _pyq_table_version(session, subject)
+        with _pyq_version_lock:
+            _pyq_version_cache[subject] = version
+    return version
+
+
+# Corpora at least this large get a product-quantized IVF index (64 bytes per vector
+# instead of 6 KB of float32); smaller ones keep the exact flat index, since IVFPQ
+# training needs plenty of vectors per centroid
+IVFPQ_MIN_VECTORS = 10000
+IVFPQ_NLIST = 64
+IVFPQ_M = 64  # sub-quantizers; EMBEDDING_DIM must be divisible by this
+IVFPQ_NBITS = 8
+IVFPQ_NPROBE = 8
+
+
+# Question embeddings keyed by (pyq id, sha256(question)) in a local SQLite file, so a
+# rebuild after the table changes only embeds new or edited PYQs
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.sqlite3")
+EMBEDDING_CACHE_LOOKUP_SIZE = 500  # ids per SELECT, under SQLite's bound-parameter limit
+_embedding_cache_lock = threading.Lock()
+
+
+def _question_hash(question: str) -> str:
+    return hashlib.sha256((question or "").encode("utf-8")).hexdigest()
+
+
+def _embedding_cache_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS pyq_embeddings ("
+        "pyq_id INTEGER NOT NULL, question_sha256 TEXT NOT NULL, vector BLOB NOT NULL, "
+        "PRIMARY KEY (pyq_id, question_sha256))"
+    )
+    return conn
+
+
+def _pyq_embeddings(pyqs: List[PYQ]) -> np.ndarray:
+    """
+    float32 embeddings of the PYQs' questions, in order. Cached vectors are reused and
+    only PYQs missing from the cache (new, or question edited) are sent to the API.
+    """
+    keys = [(pyq.id, _question_hash(pyq.question)) for pyq in pyqs]
+    cached = {}
+    with _embedding_cache_lock, closing(_embedding_cache_connection()) as conn:
+        for start in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_SIZE):
+            ids = [pyq_id for pyq_id, _ in keys[start:start + EMBEDDING_CACHE_LOOKUP_SIZE]]
+            rows = conn.execute(
+                f"SELECT pyq_id, question_sha256, vector FROM pyq_embeddings "
+                f"WHERE pyq_id IN ({','.join('?' * len(ids))})",
+                ids,
+            )
+            for pyq_id, question_sha256, vector in rows:
+                cached[(pyq_id, question_sha256)] = vector
+
+    vecs = np.empty((len(pyqs), EMBEDDING_DIM), dtype="float32")
+    needed = []
+    for i, key in enumerate(keys):
+        vector = cached.get(key)
+        if vector is None:
+            needed.append(i)
+        else:
+            vecs[i] = np.frombuffer(vector, dtype="float32")
+    if not needed:
+        return vecs
+
+    # The API round-trips run with no lock or connection held, so other subjects'
+    # builds can read and write the cache meanwhile
+    new_vecs = embedding.embed_documents([pyqs[i].question or "" for i in needed])
+    for i, vector in zip(needed, new_vecs):
+        vecs[i] = vector
+
+    with _embedding_cache_lock, closing(_embedding_cache_connection()) as conn, conn:
+        # An edited question leaves its old (id, hash) row behind; drop it
+        conn.executemany(
+            "DELETE FROM pyq_embeddings WHERE pyq_id = ?",
+            [(keys[i][0],) for i in needed],
+        )
+        conn.executemany(
+            "INSERT INTO pyq_embeddings (pyq_id, question_sha256, vector) VALUES (?, ?, ?)",
+            [(keys[i][0], keys[i][1], vecs[i].tobytes()) for i in needed],
+        )
+    return vecs
+
+
+def _build_ivfpq_vectorstore(docs: List[Document], vecs: np.ndarray) -> FAISS:
     """
-    Perform semantic search over PYQs stored in the DB using FAISS.
+    FAISS vectorstore over docs and their embeddings backed by an IndexIVFPQ (L2, like FAISS.from_embeddings).
     """
-    vectorstore = load_vectorstore_from_db(session, subject)
+    quantizer = faiss.IndexFlatL2(EMBEDDING_DIM)
+    index = faiss.IndexIVFPQ(quantizer, EMBEDDING_DIM, IVFPQ_NLIST, IVFPQ_M, IVFPQ_NBITS)
+    index.train(vecs)
+    index.add(vecs)
+    index.nprobe = IVFPQ_NPROBE
+    return FAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=InMemoryDocstore({str(i): doc for i, doc in enumerate(docs)}),
+        index_to_docstore_id={i: str(i) for i in range(len(docs))},
+    )
+
+
+def _build_vectorstore(session: Session, subject: str = None, db_lock=None) -> FAISS:
+    query_set = session.query(PYQ)
+    if subject:
+        query_set = query_set.filter(PYQ.subject == subject)
+
+    with _db_guard(db_lock):
+        pyqs = query_set.all()
+        docs = [_pyq_to_document(pyq) for pyq in pyqs]
+    if not pyqs:
+        return None  # No data to build vector store
+    vecs = _pyq_embeddings(pyqs)
+    if len(docs) >= IVFPQ_MIN_VECTORS:
+        return _build_ivfpq_vectorstore(docs, vecs)
+    return FAISS.from_embeddings(
+        list(zip([doc.page_content for doc in docs], vecs.tolist())),
+        embedding,
+        metadatas=[doc.metadata for doc in docs],
+    )
+
+
+def _remove_stale_vectorstore_dirs(subject: Optional[str], current_name: str):
+    """Delete the subject's saved vectorstores for older table versions."""
+    # Names written before the content digest was added have no trailing "-<hex>"
+    stale = re.compile(re.escape(subject or "_all") + r"-\d+-\d+(-[0-9a-f]+)?")
+    for name in os.listdir(FAISS_CACHE_DIR):
+        if name != current_name and stale.fullmatch(name):
+            shutil.rmtree(os.path.join(FAISS_CACHE_DIR, name), ignore_errors=True)
+
+
+def load_vectorstore_from_db(session: Session, subject: str = None, db_lock=None) -> FAISS:
+    """
+    Returns a FAISS vectorstore over the PYQs stored in the database for the given subject.
+    Built stores are cached in memory and on disk per (subject, table version); a rebuild
+    after the table changes only embeds PYQs missing from the embedding cache.
+    """
+    version = _cached_pyq_table_version(session, subject, db_lock)
+    if not version[1]:
+        return None  # No data to build vector store
+    key = (subject, version)
+
+    vectorstore = _VS_CACHE.get(key)
+    if vectorstore is not None:
+        return vectorstore
+
+    with _VS_CACHE_LOCK:
+        build_lock = _VS_BUILD_LOCKS.setdefault(subject, threading.Lock())
+
+    # Only builds of the same subject wait on each other
+    with build_lock:
+        # Another thread may have built it while we waited
+        vectorstore = _VS_CACHE.get(key)
+        if vectorstore is not None:
+            return vectorstore
+
+        cache_name = f"{subject or '_all'}-{version[0]}-{version[1]}-{version[2]}"
+        cache_path = os.path.join(FAISS_CACHE_DIR, cache_name)
+        if os.path.isdir(cache_path):
+            try:
+                # The pickled docstore was written by save_local below, not taken from users
+                vectorstore = FAISS.load_local(cache_path, embedding, allow_dangerous_deserialization=True)
+            except Exception as e:
+                print("Loading cached vectorstore failed:", e)
+
+        if vectorstore is None:
+            vectorstore = _build_vectorstore(session, subject, db_lock)
+            if vectorstore is None:
+                return None
+            try:
+                vectorstore.save_local(cache_path)
+            except Exception as e:
+                print("Saving vectorstore cache failed:", e)
+            else:
+                _remove_stale_vectorstore_dirs(subject, cache_name)
+
+        with _VS_CACHE_LOCK:
+            # Drop stores for older versions of this subject
+            for stale_key in [k for k in _VS_CACHE if k[0] == subject]:
+                del _VS_CACHE[stale_key]
+            _VS_CACHE[key] = vectorstore
+        return vectorstore
+
+
+def semantic_search_db(session: Session, query: str, subject: str = None, k: int = 5,
+                       vectorstore: FAISS = None, db_lock=None) -> List[Document]:
+    """
+    Perform semantic search over PYQs stored in the DB: pgvector on PostgreSQL, FAISS elsewhere.
+    Pass a prebuilt vectorstore to skip the cache lookup when searching many queries, and
+    db_lock when the session is shared between threads (only SQL statements run under it).
+    """
+    if vectorstore is None:
+        with _db_guard(db_lock):
+            use_pgvector = _pgvector_ready(session, subject)
+        if use_pgvector:
+            query_vector = embedding.embed_query(query)
+            with _db_guard(db_lock):
+                return search_pyqs_by_vector(session, query_vector, subject, k)
+
+    # Not PostgreSQL, or embed_missing_pyqs() hasn't been run for this subject yet
+    if vectorstore is None:
+        vectorstore = load_vectorstore_from_db(session, subject, db_lock)
     if not vectorstore:
         return []
 
@@ -63,61 +379,270 @@ def semantic_search_db(session: Session, query: str, subject: str = None, k: int
     return results
 
 
+SUBTOPIC_MODEL = "gpt-4o-mini"
+
+# Shared subtopic client for infer_subtopic (sync) and infer_subtopics_async; building one
+# per call re-validates settings and opens new HTTP clients
+_LLM = ChatOpenAI(temperature=0, model=SUBTOPIC_MODEL)
+
+# Maximum number of subtopic LLM calls in flight at once (keeps clear of rate limits)
+SUBTOPIC_CONCURRENCY = 8
+
+
+# Subtopics keyed by sha256(model + chunk text): an in-process LRU in front of a disk cache
+# that survives restarts, so re-uploaded notes skip the LLM call entirely
+SUBTOPIC_CACHE_SIZE = 4096
+SUBTOPIC_CACHE_DIR = os.getenv("SUBTOPIC_CACHE_DIR", ".subtopic_cache")
+_subtopic_cache = OrderedDict()
+_subtopic_lock = threading.Lock()
+_subtopic_disk_cache = diskcache.Cache(SUBTOPIC_CACHE_DIR)
+
+
+def _subtopic_key(text: str) -> str:
+    # Include the model so switching models doesn't keep serving the old model's labels
+    return hashlib.sha256(f"{SUBTOPIC_MODEL}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _get_cached_subtopic(key: str) -> Optional[str]:
+    with _subtopic_lock:
+        subtopic = _subtopic_cache.get(key)
+        if subtopic is not None:
+            _subtopic_cache.move_to_end(key)
+            return subtopic
+    subtopic = _subtopic_disk_cache.get(key)
+    if subtopic is not None:
+        _remember_subtopic(key, subtopic)
+    return subtopic
+
+
+def _remember_subtopic(key: str, subtopic: str):
+    with _subtopic_lock:
+        _subtopic_cache[key] = subtopic
+        if len(_subtopic_cache) > SUBTOPIC_CACHE_SIZE:
+            _subtopic_cache.popitem(last=False)
+
+
+def _store_subtopic(key: str, subtopic: str):
+    _remember_subtopic(key, subtopic)
+    _subtopic_disk_cache.set(key, subtopic)
+
+
+# Stable system prompt for subtopic inference. It is identical on every call and longer
+# than 1024 tokens, so OpenAI's automatic prompt caching serves it from cache and only
+# the chunk text in the human message is billed and processed at full price.
+SUBTOPIC_SYSTEM_PROMPT = """You label chunks of university lecture notes with the single most relevant subtopic.
+
+Your answer is shown to students next to previous-year exam questions (PYQs) that match the same part of the syllabus, so it must read like a syllabus heading, not like a summary.
+
+Rules:
+1. Reply with the subtopic only: 2-3 words, Title Case, no quotes, no trailing punctuation, no explanation.
+2. Name the most specific concept the chunk is mainly about. Prefer "Symmetric Encryption" over "Cryptography" when the chunk is about symmetric ciphers, and "Cryptography" over "Security" when it covers several kinds of ciphers.
+3. When the chunk covers several concepts, pick the one that takes up the most text, or the one the other concepts are examples of.
+4. Use the standard textbook name of the concept. Expand no abbreviations the syllabus itself uses (keep "DNS Spoofing", "SQL Injection", "EIA Process").
+5. Ignore page headers, footers, page numbers, references, author names, college names and table-of-contents lines.
+6. If the chunk is a title page, index, blank page or has no academic content, reply with: General
+7. Use the taxonomy below when one of its subtopics fits; otherwise produce a subtopic in the same style.
+
+Taxonomy (subject: unit: subtopics)
+
+Cyber Security
+- Security Fundamentals: CIA Triad, Security Goals, Threats And Vulnerabilities, Attack Vectors, Security Policies, Risk Assessment, Security Models
+- Cryptography: Symmetric Encryption, Asymmetric Encryption, Block Ciphers, Stream Ciphers, DES And AES, RSA Algorithm, Diffie-Hellman Key Exchange, Hash Functions, Message Authentication Codes, Digital Signatures, Public Key Infrastructure, Digital Certificates
+- Network Security: Firewall, Firewall Types, Intrusion Detection Systems, Intrusion Prevention Systems, Virtual Private Networks, IPSec, SSL/TLS, Secure Email, Wireless Security, Network Access Control
+- Attacks And Threats: Malware Types, Viruses And Worms, Trojans And Backdoors, Ransomware, Phishing, Social Engineering, Denial Of Service, Man-In-The-Middle, DNS Spoofing, Password Attacks, Botnets
+- Web And Application Security: SQL Injection, Cross-Site Scripting, Cross-Site Request Forgery, Session Hijacking, Buffer Overflow, Secure Coding, OWASP Top Ten
+- Access Control: Authentication Methods, Multi-Factor Authentication, Biometric Authentication, Authorization Models, Access Control Lists, Role-Based Access Control, Kerberos
+- Cyber Forensics: Digital Forensics, Evidence Collection, Chain Of Custody, Forensic Tools, Incident Response
+- Cyber Law And Ethics: Cyber Crime, IT Act 2000, Intellectual Property, Data Privacy, Cyber Ethics, Security Standards
+
+Environmental Sciences
+- Environment And Ecosystems: Scope Of Environmental Studies, Ecosystem Structure, Ecosystem Function, Food Chains And Webs, Ecological Pyramids, Energy Flow, Ecological Succession, Biogeochemical Cycles
+- Natural Resources: Forest Resources, Water Resources, Mineral Resources, Food Resources, Energy Resources, Renewable Energy, Land Resources, Resource Conservation
+- Biodiversity: Biodiversity Levels, Biodiversity Values, Biodiversity Hotspots, Threats To Biodiversity, Endangered Species, In-Situ Conservation, Ex-Situ Conservation
+- Environmental Pollution: Air Pollution, Water Pollution, Soil Pollution, Noise Pollution, Thermal Pollution, Marine Pollution, Nuclear Hazards, Solid Waste Management, E-Waste Management, Pollution Control
+- Global Environmental Issues: Climate Change, Global Warming, Greenhouse Effect, Ozone Depletion, Acid Rain, Desertification, Deforestation
+- Social Issues And Environment: Sustainable Development, Water Conservation, Rainwater Harvesting, Watershed Management, Resettlement And Rehabilitation, Environmental Ethics, Consumerism And Waste
+- Environmental Management: Environmental Protection Act, Air Act, Water Act, Wildlife Protection Act, Forest Conservation Act, EIA Process, Environmental Auditing, ISO 14000
+- Human Population And Environment: Population Growth, Family Welfare Programmes, Environment And Human Health, Human Rights, Women And Child Welfare, Role Of Information Technology
+
+Examples
+
+Notes: A firewall is a network security device that monitors incoming and outgoing traffic and permits or blocks packets based on a defined set of security rules. Packet-filtering firewalls inspect headers, while stateful firewalls also track the state of active connections.
+Subtopic: Firewall Types
+
+Notes: In public-key cryptography each user has a key pair. RSA relies on the difficulty of factoring the product of two large primes: choose p and q, compute n = pq and phi(n), pick e coprime to phi(n) and compute d as the inverse of e modulo phi(n).
+Subtopic: RSA Algorithm
+
+Notes: An attacker appends ' OR '1'='1 to the login form input so that the WHERE clause always evaluates to true. Parameterised queries and input validation prevent the injected text from being executed as part of the statement.
+Subtopic: SQL Injection
+
+Notes: Phishing emails impersonate banks or colleagues and urge the reader to click a link or open an attachment. Pretexting, baiting and tailgating also exploit human trust rather than technical flaws.
+Subtopic: Social Engineering
+
+Notes: Section 66 of the IT Act 2000 deals with computer related offences, while Section 43 provides for compensation for damage to computer systems. The Act also gives legal recognition to electronic records and digital signatures.
+Subtopic: IT Act 2000
+
+Notes: Suspended particulate matter, sulphur dioxide and nitrogen oxides released by vehicles and thermal power plants cause respiratory diseases. Electrostatic precipitators and scrubbers reduce emissions from industrial stacks.
+Subtopic: Air Pollution
+
+Notes: Producers convert solar energy into chemical energy, which passes to herbivores and then to carnivores. Only about ten percent of the energy at one trophic level is transferred to the next.
+Subtopic: Energy Flow
+
+Notes: Chlorofluorocarbons release chlorine atoms in the stratosphere, and each atom can break down thousands of ozone molecules. The Montreal Protocol phased out the production of most ozone-depleting substances.
+Subtopic: Ozone Depletion
+
+Notes: The Western Ghats and the Eastern Himalayas are rich in endemic species and have lost more than seventy percent of their original vegetation, which qualifies them under the criteria set by Norman Myers.
+Subtopic: Biodiversity Hotspots
+
+Notes: Rooftop runoff is collected, filtered and stored in tanks or used to recharge groundwater through percolation pits, reducing dependence on municipal supply during the dry season.
+Subtopic: Rainwater Harvesting
+
+Notes: Department of Computer Science and Engineering. Lecture Notes. Prepared by the faculty for the academic year. Page 1.
+Subtopic: General
+"""
+
+
+def _subtopic_messages(text: str) -> list:
+    return [
+        SystemMessage(content=SUBTOPIC_SYSTEM_PROMPT),
+        HumanMessage(content=f"Notes: {text}\nSubtopic:"),
+    ]
+
+
 def infer_subtopic(text: str) -> str:
     """
-    Infer subtopic using OpenAI LLM.
+    Infer subtopic using OpenAI LLM. Results are cached by content hash.
     """
-    llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-    prompt = (
-        f"Read the following academic content and suggest the most relevant subtopic "
-        f"(like 'Firewall', 'Water Pollution', etc.) in 2-3 words:\n\n{text}\n\nSubtopic:"
-    )
+    key = _subtopic_key(text)
+    cached = _get_cached_subtopic(key)
+    if cached is not None:
+        return cached
+
     try:
-        return llm.predict(prompt).strip()
+        subtopic = _LLM.invoke(_subtopic_messages(text)).content.strip()
     except Exception as e:
         print("Subtopic inference failed:", e)
-        return "General"
+        return "General"  # not cached, so the next upload retries
+    _store_subtopic(key, subtopic)
+    return subtopic
+
+
+async def infer_subtopics_async(texts: List[str]) -> List[str]:
+    """
+    Infer subtopics for many texts concurrently, in input order.
+    Failed calls fall back to "General" like infer_subtopic().
+    """
+    semaphore = asyncio.Semaphore(SUBTOPIC_CONCURRENCY)
+
+    async def infer_one(text: str) -> str:
+        key = _subtopic_key(text)
+        cached = _get_cached_subtopic(key)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            subtopic = (await _LLM.ainvoke(_subtopic_messages(text))).content.strip()
+        _store_subtopic(key, subtopic)
+        return subtopic
+
+    subtopics = await asyncio.gather(*(infer_one(text) for text in texts), return_exceptions=True)
+    results = []
+    for subtopic in subtopics:
+        if isinstance(subtopic, BaseException):
+            print("Subtopic inference failed:", subtopic)
+            subtopic = "General"
+        results.append(subtopic)
+    return results
 
 
-def get_relevant_pyqs(session: Session, query: str, subject: str = None, k: int = 3) -> List[Document]:
+def get_relevant_pyqs(session: Session, query: str, subject: str = None, k: int = 3,
+                      db_lock=None) -> List[Document]:
     """
     Get relevant PYQs from database using semantic similarity search only (no JSON fallback).
     """
-    return semantic_search_db(session, query, subject, k)
+    return semantic_search_db(session, query, subject, k, db_lock=db_lock)
+
+
+# In-process LRU of retrieval results keyed by (blake2b(query), subject, k, PYQ table
+# version), so re-uploading the same notes skips the embedding calls and vector search
+# until the subject's PYQs change
+RELEVANT_PYQS_CACHE_SIZE = 4096
+_relevant_pyqs_cache = OrderedDict()
+_relevant_pyqs_lock = threading.Lock()
+
+
+def get_relevant_pyqs_cached(session: Session, query: str, subject: str = None, k: int = 3,
+                             db_lock=None) -> List[Document]:
+    """
+    Same as get_relevant_pyqs(), but serves repeated queries from an in-process LRU cache.
+    Entries are tied to the subject's table version (cached for PYQ_VERSION_TTL seconds), so
+    adding or removing PYQs invalidates them; empty results are not cached.
+    """
+    version = _cached_pyq_table_version(session, subject, db_lock)
+    key = (hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest(), subject, k, version)
+    with _relevant_pyqs_lock:
+        cached = _relevant_pyqs_cache.get(key)
+        if cached is not None:
+            _relevant_pyqs_cache.move_to_end(key)
+            return list(cached)
+
+    results = get_relevant_pyqs(session, query, subject, k, db_lock)
+    if results:
+        with _relevant_pyqs_lock:
+            _relevant_pyqs_cache[key] = tuple(results)
+            if len(_relevant_pyqs_cache) > RELEVANT_PYQS_CACHE_SIZE:
+                _relevant_pyqs_cache.popitem(last=False)
+    return results
 
 
 def nlp_chunk_text(text: str, max_sentences: int = 5) -> List[str]:
     """
     Simple text chunking by sentence count.
-    Make sure to call nltk.download('punkt') once in your environment/setup.
+    Sentence boundaries come from blingfire's native tokenizer; each chunk is a single
+    slice of the original text from its first sentence's start to its last sentence's end.
     """
-    import nltk
-    from nltk.tokenize import sent_tokenize
+    if not text.strip():
+        return []
+    _, offsets = text_to_sentences_and_offsets(text)
+    return [
+        text[offsets[i][0]:offsets[min(i + max_sentences, len(offsets)) - 1][1]]
+        for i in range(0, len(offsets), max_sentences)
+    ]
 
-    sentences = sent_tokenize(text)
-    chunks = []
 
-    for i in range(0, len(sentences), max_sentences):
-        chunk = ' '.join(sentences[i:i + max_sentences])
-        chunks.append(chunk)
+def _match_chunks(session: Session, chunks: List[str], subject: str, k: int) -> List[List[Document]]:
+    """
+    Blocking retrieval for process_notes_and_match_pyqs: top-k PYQs for each chunk, in order.
+    """
+    use_pgvector = _pgvector_ready(session, subject)
+    # Without pgvector, build (or fetch) the subject's vectorstore once for all chunks
+    vectorstore = None if use_pgvector else load_vectorstore_from_db(session, subject)
+    if not chunks or not (use_pgvector or vectorstore):
+        return [[] for _ in chunks]
 
-    return chunks
+    # Embed every chunk in one batched request instead of one embed_query per chunk
+    chunk_vectors = embedding.embed_documents(chunks)
+    if use_pgvector:
+        return [search_pyqs_by_vector(session, vector, subject, k) for vector in chunk_vectors]
+    return [vectorstore.similarity_search_by_vector(vector, k=k) for vector in chunk_vectors]
 
 
-def process_notes_and_match_pyqs(text: str, subject: str, session: Session, k: int = 3):
+async def process_notes_and_match_pyqs(text: str, subject: str, session: Session, k: int = 3):
     """
     Processes the notes text: chunk, infer subtopic, and get matching PYQs from DB.
+    Subtopics for all chunks are inferred concurrently, while the blocking DB / embedding /
+    vector search work runs in a worker thread so the event loop stays free.
     """
     chunks = nlp_chunk_text(text)
-    results = []
+    matches, subtopics = await asyncio.gather(
+        asyncio.to_thread(_match_chunks, session, chunks, subject, k),
+        infer_subtopics_async(chunks),
+    )
 
-    for chunk in chunks:
-        subtopic = infer_subtopic(chunk)
-        matches = get_relevant_pyqs(session, chunk, subject, k=k)
-        results.append({
+    return [
+        {
             "chunk": chunk,
             "subtopic": subtopic,
-            "matches": matches
-        })
-
-    return results
\ No newline at end of file
+            "matches": chunk_matches
+        }
+        for chunk, subtopic, chunk_matches in zip(chunks, subtopics, matches)
+    ]
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+# database.py builds its engine at import time; point it at a throwaway SQLite file
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import crud
+import models
+
+# Set to a PostgreSQL URL (with pgvector available) to also exercise the COPY path
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+BACKENDS = [
+    "sqlite",
+    pytest.param(
+        "postgresql",
+        marks=pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set"),
+    ),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def db(request, tmp_path):
+    if request.param == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path}/pyqs.db")
+    else:
+        engine = create_engine(TEST_DATABASE_URL)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        yield session
+    models.PYQ.__table__.drop(bind=engine)
+    engine.dispose()
+
+
+def test_store_pyqs_keeps_missing_sub_topic_and_year_as_empty_strings(db):
+    inserted = crud.store_pyqs(
+        db,
+        [
+            {"question": "What is a firewall?", "sub_topic": "Firewall", "marks": 5, "year": "2023"},
+            {"question": "Define phishing."},
+            {"sub_topic": "Skipped: no question"},
+        ],
+        "Cyber Security",
+    )
+
+    assert inserted == 2
+    rows = {pyq.question: pyq for pyq in crud.get_pyqs_by_subject(db, "Cyber Security")}
+    assert (rows["What is a firewall?"].sub_topic, rows["What is a firewall?"].year) == ("Firewall", "2023")
+    assert rows["Define phishing."].sub_topic == ""
+    assert rows["Define phishing."].year == ""
+    assert rows["Define phishing."].marks == 0
@@ -1,23 +1,138 @@
 # utils.py
 
 import fitz  # PyMuPDF
-import re
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
 
 # 📥 Extract text from PDF and clean
-# utils.py
-import fitz  # PyMuPDF
-
-def extract_text_from_pdf(pdf_path: str):
+def extract_text_from_pdf(path_or_doc) -> Iterator[str]:
     """
-    Extracts text from each page of the PDF and returns
-    a list of text chunks (one chunk per page).
+    Lazily yields the text of each page of the PDF (one chunk per page),
+    so callers that only stream through pages never hold the whole document's text.
+    Accepts a file path or an already-open fitz.Document, which is left open
+    so callers can reuse it without parsing the file again.
     """
-    doc = fitz.open(pdf_path)
-    pages_text = []
+    if isinstance(path_or_doc, fitz.Document):
+        yield from _iter_pages_text(path_or_doc)
+        return
+    with fitz.open(path_or_doc) as doc:
+        yield from _iter_pages_text(doc)
+
+
+# Plain text with ligatures kept as single glyphs ("ﬁ") and mediabox clipping, but without
+# whitespace preservation. build_page_text_index uses the same flags, so excerpts the LLM
+# quotes from the chunk text match the characters on the page.
+TEXT_FLAGS = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_MEDIABOX_CLIP
+
+
+def _page_text(page) -> str:
+    return page.get_text("text", flags=TEXT_FLAGS)
+
+
+def _iter_pages_text(doc) -> Iterator[str]:
     for page in doc:
-        text = page.get_text("text")  # Extract page text as plain text
-        pages_text.append(text)
-    return pages_text
+        yield _page_text(page)
+
+
+# PDFs with fewer pages than this are extracted in-process; the pool round-trip isn't worth it
+PARALLEL_EXTRACT_MIN_PAGES = 32
+EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    """Shared extraction pool, started on first use. Spawned workers only import this module."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _extract_pool
+
+
+def _extract_page_range(args) -> List[str]:
+    """Worker entry point: text of pages [start, stop), opening and closing the file for this run."""
+    path, start, stop = args
+    with fitz.open(path) as doc:
+        return [_page_text(doc[i]) for i in range(start, stop)]
+
+
+def extract_text_from_pdf_parallel(doc, path: str) -> List[str]:
+    """
+    Same chunks as extract_text_from_pdf(doc). Small PDFs are read through it from the open doc;
+    large ones are split into one contiguous page range per worker of a process pool,
+    and each worker parses the file at path once for its range.
+    """
+    page_count = doc.page_count
+    if page_count < PARALLEL_EXTRACT_MIN_PAGES or EXTRACT_WORKERS < 2:
+        return list(extract_text_from_pdf(doc))
+
+    step = -(-page_count // EXTRACT_WORKERS)  # ceil division
+    ranges = [(path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    return [text for texts in _get_extract_pool().map(_extract_page_range, ranges) for text in texts]
+
+
+def build_page_text_index(page):
+    """
+    Extracts the page text once as a lower-cased, whitespace-collapsed string
+    plus a parallel list of (line_no, char_bbox) entries (None for separators),
+    so many fragments can be located without re-running page.search_for().
+    """
+    chars = []
+    boxes = []
+    line_no = 0
+    for block in page.get_text("rawdict", flags=TEXT_FLAGS)["blocks"]:
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                for ch in span.get("chars", []):
+                    c = ch["c"]
+                    if c.isspace():
+                        if chars and chars[-1] != " ":
+                            chars.append(" ")
+                            boxes.append(None)
+                        continue
+                    lower = c.lower()
+                    chars.append(lower if len(lower) == 1 else c)
+                    boxes.append((line_no, ch["bbox"]))
+            # Lines are joined by a single space, like search_for() does
+            if chars and chars[-1] != " ":
+                chars.append(" ")
+                boxes.append(None)
+            line_no += 1
+    return "".join(chars), boxes
+
+
+def find_fragment_quads(page_text: str, boxes: list, fragment: str) -> list:
+    """
+    Returns one fitz.Quad per text line covered by each occurrence of
+    fragment in an index built by build_page_text_index().
+    """
+    needle = " ".join(fragment.lower().split())
+    if not needle:
+        return []
+
+    quads = []
+    start = page_text.find(needle)
+    while start != -1:
+        line_rects = {}
+        for entry in boxes[start:start + len(needle)]:
+            if entry is None:
+                continue
+            line, bbox = entry
+            if line in line_rects:
+                line_rects[line] |= bbox
+            else:
+                line_rects[line] = fitz.Rect(bbox)
+        quads.extend(rect.quad for rect in line_rects.values())
+        start = page_text.find(needle, start + len(needle))
+    return quads
 
 
 # ✂️ Simple chunking logic (split by size)